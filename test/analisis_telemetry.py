@@ -1,5 +1,12 @@
+import math
+from functools import lru_cache
+
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.ticker import FuncFormatter
+from numba import njit
+from scipy.fft import rfft, rfftfreq
 
 # === Parámetros importados de signal_parameters.h ===
 
@@ -14,48 +21,52 @@ DERIVATIVE_FILTER_ALPHA = 0.1
 # Carga datos
 # Formato: timestamp, valor_raw
 csv_file = 'lecturas.csv'
-data = np.loadtxt(csv_file, delimiter=',', skiprows=1)
-timestamps = data[:, 0]
-raw = data[:, 1]
-
-# Filtro EPA primario
-primary_filtered = np.zeros_like(raw)
-primary_filtered[0] = raw[0]
-for i in range(1, len(raw)):
-    primary_filtered[i] = EPA_ALPHA_PRIMARY * raw[i] + (1 - EPA_ALPHA_PRIMARY) * primary_filtered[i-1]
-
-# Filtro EPA secundario
-secondary_filtered = np.zeros_like(raw)
-secondary_filtered[0] = primary_filtered[0]
-for i in range(1, len(raw)):
-    secondary_filtered[i] = EPA_ALPHA_SECONDARY * primary_filtered[i] + (1 - EPA_ALPHA_SECONDARY) * secondary_filtered[i-1]
-
-
-# Derivada con ventana sobre el primer EPA
-window_derivative_primary = np.zeros_like(primary_filtered)
-for i in range(DERIVATIVE_WINDOW_SIZE, len(primary_filtered)):
-    window_derivative_primary[i] = (primary_filtered[i] - primary_filtered[i - DERIVATIVE_WINDOW_SIZE]) / DERIVATIVE_WINDOW_SIZE
-
-
-# Derivada con ventana sobre el segundo EPA (doble EPA)
-window_derivative = np.zeros_like(secondary_filtered)
-for i in range(DERIVATIVE_WINDOW_SIZE, len(secondary_filtered)):
-    window_derivative[i] = (secondary_filtered[i] - secondary_filtered[i - DERIVATIVE_WINDOW_SIZE]) / DERIVATIVE_WINDOW_SIZE
-
-
-
-# Derivada filtrada (EPA sobre la derivada con ventana del primer EPA)
-filtered_derivative_primary = np.zeros_like(window_derivative_primary)
-filtered_derivative_primary[0] = window_derivative_primary[0]
-for i in range(1, len(window_derivative_primary)):
-    filtered_derivative_primary[i] = DERIVATIVE_FILTER_ALPHA * window_derivative_primary[i] + (1 - DERIVATIVE_FILTER_ALPHA) * filtered_derivative_primary[i-1]
-
-
-# Derivada filtrada (EPA sobre la derivada con ventana)
-filtered_derivative = np.zeros_like(window_derivative)
-filtered_derivative[0] = window_derivative[0]
-for i in range(1, len(window_derivative)):
-    filtered_derivative[i] = DERIVATIVE_FILTER_ALPHA * window_derivative[i] + (1 - DERIVATIVE_FILTER_ALPHA) * filtered_derivative[i-1]
+data = pd.read_csv(csv_file, header=0, dtype=np.float64).to_numpy()
+timestamps = data[:, 0]  # ms absolutos, se mantienen en float64
+raw = data[:, 1].astype(np.float32)  # ADC de 24 bits: float32 basta para filtros y derivadas
+
+# Pipeline completo en una sola pasada:
+#   EPA primario -> EPA secundario -> derivada con ventana (x[i] - x[i-W]) / W -> EPA sobre la derivada
+# Cada EPA es y[i] = alpha*x[i] + (1-alpha)*y[i-1], con y[0] = x[0]
+@njit(cache=True)
+def run_pipeline(raw, alpha_primary, alpha_secondary, alpha_derivative, window):
+    n = raw.shape[0]
+    primary = np.empty_like(raw)
+    secondary = np.empty_like(raw)
+    wd_primary = np.zeros_like(raw)
+    wd = np.zeros_like(raw)
+    fd_primary = np.empty_like(raw)
+    fd = np.empty_like(raw)
+    if n == 0:
+        return primary, secondary, wd_primary, wd, fd_primary, fd
+
+    p = raw[0]
+    s = p
+    fdp = 0.0
+    fds = 0.0
+    primary[0] = p
+    secondary[0] = s
+    fd_primary[0] = fdp
+    fd[0] = fds
+    for i in range(1, n):
+        p = alpha_primary * raw[i] + (1 - alpha_primary) * p
+        s = alpha_secondary * p + (1 - alpha_secondary) * s
+        primary[i] = p
+        secondary[i] = s
+        # Sin ventana completa todavía: derivada a 0
+        if i >= window:
+            wd_primary[i] = (p - primary[i - window]) / window
+            wd[i] = (s - secondary[i - window]) / window
+        fdp = alpha_derivative * wd_primary[i] + (1 - alpha_derivative) * fdp
+        fds = alpha_derivative * wd[i] + (1 - alpha_derivative) * fds
+        fd_primary[i] = fdp
+        fd[i] = fds
+    return primary, secondary, wd_primary, wd, fd_primary, fd
+
+(primary_filtered, secondary_filtered,
+ window_derivative_primary, window_derivative,
+ filtered_derivative_primary, filtered_derivative) = run_pipeline(
+    raw, EPA_ALPHA_PRIMARY, EPA_ALPHA_SECONDARY, DERIVATIVE_FILTER_ALPHA, DERIVATIVE_WINDOW_SIZE)
 
 
 
@@ -67,32 +78,45 @@ for i in range(1, len(window_derivative)):
 PRE_EVENT_PERIOD_MS = 400  # Compensar retardo de filtros (400 ms delante)
 POST_EVENT_PERIOD_MS = 0   # No añadir post-evento
 SENSOR_SAMPLE_INTERVAL_MS = 10  # 100 Hz = 10 ms por muestra
-import math
 PRE_EVENT_SAMPLES = math.ceil(PRE_EVENT_PERIOD_MS / SENSOR_SAMPLE_INTERVAL_MS)
 POST_EVENT_SAMPLES = math.ceil(POST_EVENT_PERIOD_MS / SENSOR_SAMPLE_INTERVAL_MS)
 
-# Detección de eventos (1 si derivada filtrada > threshold, 0 si no)
-event_flag = (np.abs(filtered_derivative) > DERIVATIVE_THRESHOLD).astype(int)
+# Detección de eventos (True si |derivada filtrada| > threshold), sin temporales intermedios
+abs_derivative = np.empty_like(filtered_derivative)
+event_flag = np.empty_like(filtered_derivative, dtype=bool)
+np.abs(filtered_derivative, out=abs_derivative)
+np.greater(abs_derivative, DERIVATIVE_THRESHOLD, out=event_flag)
 
 # --- Construcción de máscara de tramos: 0=estable, 1=evento, 2=pre, 3=post ---
-segment_mask = np.zeros_like(event_flag)
+segment_mask = np.zeros_like(event_flag, dtype=int)
 
-# Detectar inicios y finales de eventos
-in_event = False
-event_segments = []  # (start_idx, end_idx)
-for i, flag in enumerate(event_flag):
-    if not in_event and flag:
-        event_start = i
-        in_event = True
-    elif in_event and not flag:
-        event_end = i-1
-        event_segments.append((event_start, event_end))
-        in_event = False
-# Si termina en evento
-if in_event:
-    event_segments.append((event_start, len(event_flag)-1))
+# Detectar inicios y finales de eventos (flancos de subida/bajada de event_flag)
+edges = np.diff(np.concatenate(([0], event_flag, [0])))
+event_starts = np.flatnonzero(edges == 1)
+event_ends = np.flatnonzero(edges == -1) - 1
+event_segments = list(zip(event_starts, event_ends))  # (start_idx, end_idx)
+event_pre_starts = np.maximum(0, event_starts - PRE_EVENT_SAMPLES)
 
+# Marca los tramos [inicio, fin) acumulando +1/-1 en los bordes
+def ranges_to_mask(begins, stops, n):
+    counts = np.zeros(n + 1, dtype=int)
+    np.add.at(counts, begins, 1)
+    np.add.at(counts, stops, -1)
+    return np.cumsum(counts[:-1]) > 0
 
+# Pre-evento después de evento: el pre de un evento pisa la cola del anterior si se solapan
+segment_mask[ranges_to_mask(event_starts, event_ends + 1, len(segment_mask))] = 1
+segment_mask[ranges_to_mask(event_pre_starts, event_starts, len(segment_mask))] = 2
+
+
+
+HF_CUTOFF_HZ = 10  # Límite inferior de la energía de alta frecuencia
+
+# Rejilla de frecuencias de la FFT y primer bin por encima de HF_CUTOFF_HZ, reutilizados entre eventos de igual longitud
+@lru_cache(maxsize=None)
+def freqs_and_hf_start(n):
+    xf = rfftfreq(n, d=SENSOR_SAMPLE_INTERVAL_MS/1000)
+    return xf, int(np.searchsorted(xf, HF_CUTOFF_HZ, side='right'))
 
 # --- Cálculo de indicadores clave por evento ---
 print(f"PRE_EVENT_SAMPLES: {PRE_EVENT_SAMPLES}, POST_EVENT_SAMPLES: {POST_EVENT_SAMPLES}")
@@ -100,15 +124,13 @@ event_indicators = []
 for idx, (start, end) in enumerate(event_segments):
     pre_start = max(0, start - PRE_EVENT_SAMPLES)
     print(f"Evento {idx}: pre [{pre_start}:{start-1}], evento [{start}:{end}]")
-    segment_mask[pre_start:start] = 2
-    segment_mask[start:end+1] = 1
 
     # --- Extraer datos del tramo (evento + pre) ---
     seg_idx = np.arange(pre_start, end+1)
     seg_time = timestamps[seg_idx]
     seg_raw = raw[seg_idx]
     seg_filtered = secondary_filtered[seg_idx]
-    seg_deriv = np.gradient(seg_raw, seg_time)
+    seg_deriv = np.gradient(seg_raw, SENSOR_SAMPLE_INTERVAL_MS)  # Muestreo uniforme (unidades por ms)
 
     # 1) Cambio de presión total (ΔP)
     delta_p = seg_raw[-1] - seg_raw[0]
@@ -127,14 +149,14 @@ for idx, (start, end) in enumerate(event_segments):
     stable_idx = np.where(np.abs(seg_raw - final_val) < tol)[0]
     t_stabilize = (seg_time[stable_idx[0]] - seg_time[0]) if len(stable_idx) > 0 else np.nan
     # 7) Frecuencia dominante (FFT)
-    from scipy.fft import rfft, rfftfreq
     N = len(seg_raw)
     if N > 1:
-        yf = np.abs(rfft(seg_raw - np.mean(seg_raw)))
-        xf = rfftfreq(N, d=SENSOR_SAMPLE_INTERVAL_MS/1000)
-        dom_freq = xf[np.argmax(yf[1:])+1] if len(yf) > 1 else 0
+        yf = np.abs(rfft(seg_raw - np.mean(seg_raw), workers=-1))
+        xf, hf_start = freqs_and_hf_start(N)
+        dom_freq = xf[1 + int(np.argmax(yf[1:]))] if len(yf) > 1 else 0
         # 8) Energía de alta frecuencia (por encima de 10 Hz)
-        hf_energy = np.sum(yf[xf > 10]**2)
+        hf = yf[hf_start:]
+        hf_energy = float(hf @ hf)
     else:
         dom_freq = 0
         hf_energy = 0
@@ -169,7 +191,6 @@ for seg_type in [2, 0, 3, 1]:  # Orden: pre, estable, post, evento
         axs[0].plot(timestamps[mask], secondary_filtered[mask], '.', color=colors[seg_type], label=labels[seg_type], alpha=0.7)
 axs[0].plot(timestamps, raw, label="Señal original (RAW)", color="black", alpha=0.3)
 # Mostrar escala de tiempo en segundos en el eje x
-from matplotlib.ticker import FuncFormatter
 def ms_to_s(x, pos):
     return f"{x/1000:.1f}"
 axs[0].set_title("Señal original y doble EPA (coloreado por tramo)")
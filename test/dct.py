@@ -1,7 +1,7 @@
 import serial
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.fftpack import dct
+from scipy.fft import dct
 
 SERIAL_PORT = '/dev/cu.usbmodem1101'
 BAUD_RATE = 115200
@@ -10,25 +10,36 @@ SAMPLING_FREQ = 100  # Hz (ajusta si tu micro envía a otra frecuencia)
 
 def get_samples():
     samples = []
+    rx_buffer = bytearray()
     with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=2) as ser:
         print(f"Collecting {NUM_SAMPLES} samples...")
         while len(samples) < NUM_SAMPLES:
-            line = ser.readline().decode('utf-8', errors='ignore').strip()
-            if line:
-                print(f"Linea recibida: {line}")  # Depuración
-            if ',' in line and line[0].isdigit():
-                _, raw_str = line.split(',', 1)
-                raw = int(raw_str)
-                samples.append(raw)
-                if len(samples) % 100 == 0:
-                    print(f"{len(samples)} muestras recogidas")
+            # Lee todo lo disponible (o espera al menos un byte) y procesa solo líneas completas
+            rx_buffer += ser.read(ser.in_waiting or 1)
+            lines = rx_buffer.split(b'\n')
+            rx_buffer = lines.pop()
+            for line in lines:
+                line = line.decode('utf-8', errors='ignore').strip()
+                if line:
+                    print(f"Linea recibida: {line}")  # Depuración
+                if ',' in line and line[0].isdigit():
+                    _, raw_str = line.split(',', 1)
+                    try:
+                        raw = int(raw_str)
+                    except ValueError:
+                        continue  # Línea corrupta, ignora
+                    samples.append(raw)
+                    if len(samples) % 100 == 0:
+                        print(f"{len(samples)} muestras recogidas")
+                    if len(samples) == NUM_SAMPLES:
+                        break
     print("Done.")
     return np.array(samples)
 
 def main():
     samples = get_samples()
     # DCT tipo II
-    dct_coeffs = dct(samples, norm='ortho')
+    dct_coeffs = dct(samples, norm='ortho', workers=-1)
     # Frecuencias asociadas (Hz)
     freqs = np.arange(NUM_SAMPLES) * SAMPLING_FREQ / (2 * NUM_SAMPLES)
     # Mostrar coeficiente DC (k=0) aparte
@@ -1,7 +1,9 @@
 import serial
+import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
-from collections import deque
+from matplotlib.lines import Line2D
+from numba import njit
 
 SERIAL_PORT = '/dev/cu.usbmodem1101'
 BAUD_RATE = 115200
@@ -11,16 +13,26 @@ WINDOW_SECONDS = 20
 Y_MIN = 1500000
 Y_MAX = 4000000
 
-timestamps = deque(maxlen=MAX_POINTS)
-raws = deque(maxlen=MAX_POINTS)
-double_ema_filtered = deque(maxlen=MAX_POINTS)
-raw_timestamps = deque(maxlen=MAX_POINTS)  # Timestamps absolutos en ms
-start_ts = None
+# Buffers circulares (un array contiguo por campo): la muestra n se guarda en [n % MAX_POINTS]
+raw_timestamps = np.empty(MAX_POINTS, dtype=np.int64)  # Timestamps absolutos en ms
+raws = np.empty(MAX_POINTS, dtype=np.int32)  # ADC de 24 bits
+double_ema_filtered = np.empty(MAX_POINTS, dtype=np.float32)
+sample_count = 0  # Total de muestras recibidas
+rx_buffer = bytearray()  # Bytes recibidos pendientes de completar línea
+RESTART_MAX_TS_MS = 1000  # Timestamp hacia atrás por debajo de esto: el ESP32 se ha reiniciado
+suspect_sample = None  # (ts, raw) hacia atrás pendiente de confirmar como reinicio
 
 # Parámetros para filtro exponencial doble (asimétrico)
 fast_alpha = 0.25   # Más rápido, sigue mejor la RAW
 slow_alpha = 0.08    # Más rápido, pero aún suaviza el ruido
 edge_threshold = 12000  # Umbral robusto para cambios reales (ajusta según tu gráfica)
+one_minus_fast = 1 - fast_alpha
+one_minus_slow = 1 - slow_alpha
+
+# Derivada suavizada: (media de los N siguientes - media de los N anteriores) / dt
+# np.convolve invierte el kernel: +1/N para las muestras futuras, -1/N para las pasadas
+DERIV_N = 10
+DERIV_KERNEL = np.concatenate((np.ones(DERIV_N) / DERIV_N, [0.0], -np.ones(DERIV_N) / DERIV_N))
 
 # Lists to store edge start and end times (en segundos absolutos)
 edge_starts_abs = []
@@ -29,7 +41,9 @@ edge_active = False
 
 # Añade esta lista global al inicio del archivo
 edge_events_log = []
-vertical_lines = []  # Añade esto al inicio del archivo
+MAX_EDGE_LINES = 16     # Líneas verticales reservadas por tipo de flanco (se reutilizan cada frame)
+edge_start_lines = []   # Se rellenan en setup_plot()
+edge_end_lines = []
 MIN_STABLE_TIME = 1.5   # segundos mínimos en estado estable antes de aceptar nuevo cambio
 MIN_EDGE_TIME = 1.5     # segundos mínimos en estado de cambio antes de aceptar vuelta a estable
 FRAMES_REQUIRED = 8     # número de frames consecutivos para confirmar cambio
@@ -40,50 +54,103 @@ last_edge_start_time = 0
 stable_counter = 0
 change_counter = 0
 
-def read_serial_data(ser):
-    global start_ts
-    latest_raw = None
+def ring_ordered(buf):
+    """Devuelve las muestras del buffer circular en orden cronológico."""
+    if sample_count <= MAX_POINTS:
+        return buf[:sample_count]
+    head = sample_count % MAX_POINTS
+    return np.concatenate((buf[head:], buf[:head]))
+
+@njit(cache=True)
+def double_ema_batch(new_raws, prev_double, fast_a, one_minus_fast_a, slow_a, one_minus_slow_a, threshold):
+    """Aplica el doble EMA asimétrico a un bloque de muestras partiendo de prev_double."""
+    out = np.empty(new_raws.shape[0], dtype=np.float64)
+    for i in range(new_raws.shape[0]):
+        # Calcular filtros rápido y lento
+        fast_ema = fast_a * new_raws[i] + one_minus_fast_a * prev_double
+        slow_ema = slow_a * new_raws[i] + one_minus_slow_a * prev_double
+        # Filtro adaptativo: en transiciones (filtros separados) el rápido (menos retardo),
+        # en estado estable el lento (más estabilidad)
+        prev_double = fast_ema if abs(fast_ema - slow_ema) > threshold else slow_ema
+        out[i] = prev_double
+    return out
+
+def reset_edge_detection():
+    """Vuelve el detector de flancos a su estado inicial (p. ej. tras reiniciarse el reloj del ESP32)."""
+    global edge_active, last_edge_end_time, last_edge_start_time, stable_counter, change_counter
+    edge_active = False
+    last_edge_end_time = 0
+    last_edge_start_time = 0
+    stable_counter = 0
+    change_counter = 0
+    edge_starts_abs.clear()
+    edge_ends_abs.clear()
 
-    while ser.in_waiting:
-        line = ser.readline().decode('utf-8', errors='ignore').strip()
+def read_serial_data(ser):
+    global sample_count, rx_buffer, suspect_sample
+
+    # Lee de golpe todo lo disponible y procesa solo las líneas completas
+    if ser.in_waiting:
+        rx_buffer += ser.read(ser.in_waiting)
+    lines = rx_buffer.split(b'\n')
+    rx_buffer = lines.pop()
+
+    # Si el ESP32 se reinicia millis() vuelve a empezar: se descarta el histórico y se
+    # reinicia el filtro para que los timestamps del buffer sigan ordenados. Un timestamp
+    # hacia atrás solo cuenta como reinicio si es casi 0 o si la siguiente muestra lo confirma;
+    # si no, es una línea corrupta y se descarta.
+    last_ts = int(raw_timestamps[(sample_count - 1) % MAX_POINTS]) if sample_count else None
+    restarted = False
+    new_ts = []
+    new_raws = []
+    for line in lines:
+        line = line.decode('utf-8', errors='ignore').strip()
         if ',' in line and line[0].isdigit():
             ts_str, raw_str = line.split(',', 1)
-            ts = int(ts_str)
-            raw = int(raw_str)
-            latest_raw = raw
-            if start_ts is None:
-                start_ts = ts
-            # Tiempo relativo en segundos desde el primer dato recibido
-            t = (ts - start_ts) / 1000.0
-            timestamps.append(t)
-            raw_timestamps.append(ts)  # <-- Guarda el timestamp absoluto
-            raws.append(raw)
-
-            # Double EMA (asimétrico)
-            if len(double_ema_filtered) == 0:
-                # Inicializar el filtro con el primer valor
-                double_ema_filtered.append(raw)
-            else:
-                # Obtener valor anterior
-                prev_double = double_ema_filtered[-1]
-                
-                # Calcular filtros rápido y lento
-                fast_ema = fast_alpha * raw + (1 - fast_alpha) * prev_double
-                slow_ema = slow_alpha * raw + (1 - slow_alpha) * prev_double
-                
-                # Detectar cambios significativos comparando filtros
-                edge_detected = abs(fast_ema - slow_ema) > edge_threshold
-                
-                if edge_detected:
-                    # En transiciones: usar filtro rápido para reducir retardo
-                    adaptive_alpha = fast_alpha
-                else:
-                    # En estado estable: usar filtro lento para más estabilidad
-                    adaptive_alpha = slow_alpha
-                
-                # Aplicar filtro adaptativo
-                double_ema_value = adaptive_alpha * raw + (1 - adaptive_alpha) * prev_double
-                double_ema_filtered.append(double_ema_value)
+            try:
+                ts = int(ts_str)
+                raw = int(raw_str)
+            except ValueError:
+                continue  # Línea corrupta, ignora
+            if last_ts is not None and ts < last_ts:
+                confirmed = suspect_sample is not None and suspect_sample[0] <= ts
+                if ts >= RESTART_MAX_TS_MS and not confirmed:
+                    suspect_sample = (ts, raw)
+                    continue
+                # Reinicio: lo recibido hasta ahora pertenece a la sesión anterior
+                restarted = True
+                new_ts = [suspect_sample[0]] if confirmed else []
+                new_raws = [suspect_sample[1]] if confirmed else []
+            suspect_sample = None
+            new_ts.append(ts)
+            new_raws.append(raw)
+            last_ts = ts
+    if not new_raws:
+        return None
+
+    latest_raw = new_raws[-1]
+    ts_block = np.array(new_ts, dtype=np.int64)
+    raw_block = np.array(new_raws, dtype=np.int32)
+    if restarted:
+        sample_count = 0
+        reset_edge_detection()
+
+    n_new = len(raw_block)
+    skip = max(0, n_new - MAX_POINTS)  # Solo caben las últimas MAX_POINTS muestras del bloque
+
+    # Double EMA (asimétrico); la primera muestra inicializa el filtro
+    if sample_count == 0:
+        prev_double = float(raw_block[0])
+    else:
+        prev_double = float(double_ema_filtered[(sample_count - 1) % MAX_POINTS])
+    ema_block = double_ema_batch(raw_block, prev_double, fast_alpha, one_minus_fast,
+                                 slow_alpha, one_minus_slow, edge_threshold)
+
+    idx = (sample_count + np.arange(skip, n_new)) % MAX_POINTS
+    raw_timestamps[idx] = ts_block[skip:]  # <-- Guarda el timestamp absoluto
+    raws[idx] = raw_block[skip:]
+    double_ema_filtered[idx] = ema_block[skip:]
+    sample_count += n_new
     return latest_raw
 
 def setup_plot():
@@ -92,7 +159,6 @@ def setup_plot():
     line_double_ema, = ax.plot([], [], 'green', label=f'Double EMA (α_fast={fast_alpha}, α_slow={slow_alpha})', linewidth=2)
     ax.set_xlabel('Time (s)')
     ax.set_ylabel('RAW Value')
-    ax.legend(loc='upper right')
     ax.grid(True, alpha=0.3)
     ax.set_ylim(Y_MIN, Y_MAX)
     value_text = ax.text(0.02, 0.98, '', transform=ax.transAxes, fontsize=12,
@@ -102,50 +168,60 @@ def setup_plot():
     line_deriv, = ax2.plot([], [], 'magenta', label='d(Double EMA)/dt', linewidth=1)
     ax2.set_ylabel('Derivative')
     ax2.legend(loc='lower right')
+    # Líneas verticales persistentes para EDGE START (rojo) y EDGE END (naranja), ocultas hasta usarse
+    for _ in range(MAX_EDGE_LINES):
+        edge_start_lines.append(ax.axvline(x=0, color='red', linestyle='--', linewidth=1.5, visible=False))
+        edge_end_lines.append(ax.axvline(x=0, color='orange', linestyle='--', linewidth=1.5, visible=False))
+    # Línea horizontal en el gráfico principal a 335500
+    threshold_line = ax.axhline(y=335500, color='purple', linestyle=':', linewidth=2, label='Threshold 335500')
+    # Leyenda fija: las líneas de flancos se representan con artistas "proxy"
+    edge_start_proxy = Line2D([], [], color='red', linestyle='--', linewidth=1.5, label='EDGE START')
+    edge_end_proxy = Line2D([], [], color='orange', linestyle='--', linewidth=1.5, label='EDGE END')
+    ax.legend(handles=[line_raw, line_double_ema, threshold_line, edge_start_proxy, edge_end_proxy], loc='upper right')
     return fig, ax, ax2, line_raw, line_double_ema, line_deriv, value_text
 
+def show_edge_lines(lines, times, tmin_abs, tmax_abs):
+    """Coloca las líneas del pool en los flancos visibles más recientes y oculta el resto."""
+    visible_times = [t for t in times if tmin_abs <= t <= tmax_abs][-len(lines):]
+    for i, vline in enumerate(lines):
+        if i < len(visible_times):
+            vline.set_xdata([visible_times[i], visible_times[i]])
+            vline.set_visible(True)
+        else:
+            vline.set_visible(False)
+
 def update_plot(frame, ser, ax, ax2, line_raw, line_double_ema, line_deriv, value_text):
     global edge_active, last_edge_end_time, last_edge_start_time, stable_counter, change_counter
     raw_value = read_serial_data(ser)
-    if not raw_timestamps or len(raw_timestamps) < 2:
+    if sample_count < 2:
         ax.set_title("Waiting for WNK1MA sensor data...")
         value_text.set_text('No data')
         return line_raw, line_double_ema, line_deriv, value_text
 
-    tmax_abs = raw_timestamps[-1] / 1000.0
+    last = (sample_count - 1) % MAX_POINTS
+    tmax_abs = raw_timestamps[last] / 1000.0
     tmin_abs = max(0, tmax_abs - WINDOW_SECONDS)
 
-    x = [(ts / 1000.0) for ts in raw_timestamps]
-    y_raw = list(raws)
-    y_double_ema = list(double_ema_filtered)
-    idxs = [i for i, t in enumerate(x) if tmin_abs <= t <= tmax_abs]
+    # Los timestamps llegan ordenados: la ventana visible es un rango contiguo
+    x = ring_ordered(raw_timestamps) / 1000.0
+    lo = np.searchsorted(x, tmin_abs, side='left')
+    hi = np.searchsorted(x, tmax_abs, side='right')
 
-    if not idxs:
+    if hi <= lo:
         ax.set_title("No data in window")
         value_text.set_text('No data in window')
         return line_raw, line_double_ema, line_deriv, value_text
 
-    x_window = [x[i] for i in idxs]
-    y_raw_window = [y_raw[i] for i in idxs]
-    y_double_ema_window = [y_double_ema[i] for i in idxs]
+    x_window = x[lo:hi]
+    y_raw_window = ring_ordered(raws)[lo:hi]
+    y_double_ema_window = ring_ordered(double_ema_filtered)[lo:hi]
 
     # Derivada de la doble EMA
-    if len(x_window) >= 2:
-        # Derivada suavizada: diferencia entre la media de los 10 anteriores y los 10 siguientes
-        N = 10
-        deriv_window = []
-        x_deriv = []
-        if len(x_window) >= 2 * N + 1:
-            for i in range(N, len(x_window) - N):
-                prev_mean = sum(y_double_ema_window[i-N:i]) / N
-                next_mean = sum(y_double_ema_window[i+1:i+1+N]) / N
-                dt = x_window[i+N] - x_window[i-N]
-                deriv = (next_mean - prev_mean) / dt if dt != 0 else 0
-                deriv_window.append(deriv)
-                x_deriv.append(x_window[i])
-        else:
-            deriv_window = []
-            x_deriv = []
+    if len(x_window) >= 2 * DERIV_N + 1:
+        mean_diff = np.convolve(y_double_ema_window, DERIV_KERNEL, mode='valid')
+        dt = x_window[2 * DERIV_N:] - x_window[:-2 * DERIV_N]
+        deriv_window = np.divide(mean_diff, dt, out=np.zeros_like(mean_diff), where=dt != 0)
+        x_deriv = x_window[DERIV_N:-DERIV_N]
     else:
         deriv_window = []
         x_deriv = []
@@ -156,22 +232,19 @@ def update_plot(frame, ser, ax, ax2, line_raw, line_double_ema, line_deriv, valu
     ax.set_xlim(tmin_abs, tmax_abs)
     ax2.set_xlim(tmin_abs, tmax_abs)
 
-    # Línea horizontal en el gráfico principal a 335500
-    ax.axhline(y=335500, color='purple', linestyle=':', linewidth=2, label='Threshold 335500')
-
     # Escala del eje derivada x5 respecto a la original
     ax2.set_ylim(-1000000, 1000000)  # Escala x5 respecto a -100000, 100000
 
     # --- Detección de cambios significativos ---
-    if len(double_ema_filtered) >= 2:
-        last_raw = raws[-1]
-        prev_double = double_ema_filtered[-2]
-        fast_ema = fast_alpha * last_raw + (1 - fast_alpha) * prev_double
-        slow_ema = slow_alpha * last_raw + (1 - slow_alpha) * prev_double
+    if sample_count >= 2:
+        last_raw = raws[last]
+        prev_double = float(double_ema_filtered[(sample_count - 2) % MAX_POINTS])
+        fast_ema = fast_alpha * last_raw + one_minus_fast * prev_double
+        slow_ema = slow_alpha * last_raw + one_minus_slow * prev_double
         edge_diff = abs(fast_ema - slow_ema)
         edge_detected = edge_diff > edge_threshold
 
-        current_time_abs = raw_timestamps[-1] / 1000.0
+        current_time_abs = raw_timestamps[last] / 1000.0
 
         # Histéresis por frames consecutivos
         if edge_detected:
@@ -199,31 +272,15 @@ def update_plot(frame, ser, ax, ax2, line_raw, line_double_ema, line_deriv, valu
 
     value_text.set_text(
         f"RAW: {raw_value if raw_value else '-'}\n"
-        f"DoubleEMA: {int(y_double_ema_window[-1]) if y_double_ema_window else '-'}\n"
+        f"DoubleEMA: {int(y_double_ema_window[-1]) if len(y_double_ema_window) else '-'}\n"
         f"Time: {tmax_abs:.1f}s\n"
         f"{events_text}"
     )
     ax.set_title(f"WNK1MA Pressure Sensor - Real Time Monitoring ({len(x_window)} samples)")
 
-    # Elimina líneas verticales previas
-    for vline in vertical_lines:
-        vline.remove()
-    vertical_lines.clear()
-
-    # Dibuja líneas verticales para EDGE START (rojo) y EDGE END (naranja) dentro de la ventana visible
-    for t in edge_starts_abs:
-        if tmin_abs <= t <= tmax_abs:
-            vline = ax.axvline(x=t, color='red', linestyle='--', linewidth=1.5, label='EDGE START')
-            vertical_lines.append(vline)
-    for t in edge_ends_abs:
-        if tmin_abs <= t <= tmax_abs:
-            vline = ax.axvline(x=t, color='orange', linestyle='--', linewidth=1.5, label='EDGE END')
-            vertical_lines.append(vline)
-
-    # Actualiza la leyenda sin duplicados
-    handles, labels = ax.get_legend_handles_labels()
-    unique = dict(zip(labels, handles))
-    ax.legend(unique.values(), unique.keys())
+    # Mueve las líneas verticales de EDGE START (rojo) y EDGE END (naranja) dentro de la ventana visible
+    show_edge_lines(edge_start_lines, edge_starts_abs, tmin_abs, tmax_abs)
+    show_edge_lines(edge_end_lines, edge_ends_abs, tmin_abs, tmax_abs)
 
     return line_raw, line_double_ema, line_deriv, value_text
 
@@ -4,23 +4,34 @@ import csv
 SERIAL_PORT = '/dev/tty.usbmodem1101'  # Cambia si tu dispositivo tiene otro sufijo
 BAUDRATE = 115200
 CSV_FILE = 'lecturas.csv'
+WRITE_BATCH_SIZE = 4096  # Filas acumuladas antes de escribir al fichero
 
 with serial.Serial(SERIAL_PORT, BAUDRATE, timeout=1) as ser, open(CSV_FILE, 'w', newline='') as csvfile:
     writer = csv.writer(csvfile)
     writer.writerow(['timestamp_ms', 'valor_raw'])  # Cabecera opcional
     print("Grabando datos... Pulsa Ctrl+C para parar.")
+    rx_buffer = bytearray()
+    batch = []
     try:
         while True:
-            line = ser.readline().decode('utf-8').strip()
-            if line and ',' in line:
-                parts = line.split(',')
+            # Lee todo lo disponible (o espera al menos un byte) y procesa solo líneas completas
+            rx_buffer += ser.read(ser.in_waiting or 1)
+            lines = rx_buffer.split(b'\n')
+            rx_buffer = lines.pop()
+            for line in lines:
+                parts = line.split(b',')
                 if len(parts) == 2:
                     try:
-                        timestamp = int(parts[0].strip())
-                        valor = int(parts[1].strip())
-                        writer.writerow([timestamp, valor])
+                        timestamp = int(parts[0])
+                        valor = int(parts[1])
+                        batch.append((timestamp, valor))
                         print(timestamp, valor)
                     except ValueError:
                         pass  # Línea corrupta, ignora
+            if len(batch) >= WRITE_BATCH_SIZE:
+                writer.writerows(batch)
+                batch.clear()
     except KeyboardInterrupt:
         print("\nGrabación finalizada.")
+    finally:
+        writer.writerows(batch)  # Vuelca las filas pendientes en cualquier salida